@@ -5,7 +5,9 @@ Removes keystroke-by-keystroke capture and shows final rendered output.
 """
 
 import sys
-import pyte
+from functools import lru_cache
+from itertools import groupby, repeat
+from operator import itemgetter
 
 # ANSI color to CSS color mapping
 COLORS = {
@@ -30,142 +32,191 @@ COLORS = {
     'brightwhite': '#eeeeec',
 }
 
-def char_to_html(char):
-    """Convert a pyte Char to HTML with styling."""
-    if char.data == ' ' and char.fg == 'default' and char.bg == 'default':
-        return ' '
+# HTML escapes, applied to whole runs of text at once
+_HTML_ESC = str.maketrans({'<': '&lt;', '>': '&gt;', '&': '&amp;'})
 
-    styles = []
+# Field accessors for pyte Chars: (fg, bg, bold) and data
+_cell_style = itemgetter(1, 2, 3)
+_cell_data = itemgetter(0)
 
-    # Foreground color
-    fg = char.fg
-    if fg and fg != 'default':
-        if isinstance(fg, str):
-            color = COLORS.get(fg, COLORS.get('bright' + fg, '#d3d7cf'))
-        else:
-            # 256-color or RGB
-            color = f'#{fg:06x}' if isinstance(fg, int) else '#d3d7cf'
-        styles.append(f'color:{color}')
 
-    # Background color
-    bg = char.bg
-    if bg and bg != 'default':
-        if isinstance(bg, str):
-            color = COLORS.get(bg, COLORS.get('bright' + bg, '#000000'))
-        else:
-            color = f'#{bg:06x}' if isinstance(bg, int) else '#000000'
-        styles.append(f'background-color:{color}')
+def resolve_color(color, fallback):
+    """Resolve a pyte color (name or 24-bit int) to a CSS color."""
+    if isinstance(color, str):
+        return COLORS.get(color, fallback)
+    # 256-color or RGB
+    return f'#{color:06x}' if isinstance(color, int) else fallback
 
-    # Bold
-    if char.bold:
-        styles.append('font-weight:bold')
 
-    # Escape HTML
-    data = char.data
-    if data == '<':
-        data = '&lt;'
-    elif data == '>':
-        data = '&gt;'
-    elif data == '&':
-        data = '&amp;'
+@lru_cache(maxsize=4096)
+def style_for(fg, bg, bold):
+    """Return the opening <span> tag for a style, or '' if unstyled."""
+    styles = []
+    if fg and fg != 'default':
+        styles.append(f'color:{resolve_color(fg, "#d3d7cf")}')
+    if bg and bg != 'default':
+        styles.append(f'background-color:{resolve_color(bg, "#000000")}')
+    if bold:
+        styles.append('font-weight:bold')
 
     if styles:
-        return f'<span style="{";".join(styles)}">{data}</span>'
-    return data
+        return f'<span style="{";".join(styles)}">'
+    return ''
 
 
-def screen_to_html(screen):
-    """Convert pyte screen to HTML with colors."""
-    lines = []
-
-    for y in range(screen.lines):
+def emit_run(parts, tag, chars):
+    """Append a run of identically styled characters to parts."""
+    text = ''.join(chars).translate(_HTML_ESC)
+    if tag:
+        parts.append(f'{tag}{text}</span>')
+    else:
+        parts.append(text)
+
+
+def iter_screen_html(screen):
+    """Yield the HTML for each non-empty line of a pyte screen.
+
+    Adjacent cells with the same style are coalesced into a single <span>,
+    so output grows with the number of style changes rather than cells.
+    """
+    # pyte's buffer is sparse: rows and cells that were never written are
+    # absent, and blank rows produce no output, so only visit stored ones
+    buffer = screen.buffer
+    for y in sorted(buffer):
+        line = buffer[y]
+        if not line:
+            continue
         line_html = []
-        line = screen.buffer[y]
 
-        # Find last non-empty character
+        # Find last non-empty character, scanning back from the row's end
         last_char = 0
-        for x in range(screen.columns):
-            if line[x].data != ' ' or line[x].bg != 'default':
-                last_char = x
-
-        # Only process up to last non-empty char
-        for x in range(last_char + 1):
+        for x in sorted(line, reverse=True):
             char = line[x]
-            line_html.append(char_to_html(char))
-
+            if x < screen.columns and (char.data != ' ' or char.bg != 'default'):
+                last_char = x
+                break
+
+        # Only process up to last non-empty char. Fetching cells and
+        # grouping them into runs is done by map/groupby/itemgetter, so
+        # the per-cell work stays in C and Python only runs once per run.
+        # An unstyled row is a single run emitted without a <span>, which
+        # is why there is no separate plain-text path: checking a screen
+        # or row for styling costs as much as the grouping it would skip.
+        cells = map(line.get, range(last_char + 1), repeat(line.default))
+        for (fg, bg, bold), run in groupby(cells, _cell_style):
+            emit_run(line_html, style_for(fg, bg, bold), map(_cell_data, run))
+
+        # Lines are right-stripped, so a non-empty line never ends blank
         line_str = ''.join(line_html).rstrip()
         if line_str:
-            lines.append(line_str)
-
-    # Remove trailing empty lines
-    while lines and not lines[-1].strip():
-        lines.pop()
-
-    return '\n'.join(lines)
+            yield line_str
 
 
-def clean_log(input_file, output_file=None, html=False):
-    """Process a script typescript file and output clean text or HTML."""
-
-    # Read the raw log
-    with open(input_file, 'rb') as f:
-        data = f.read()
-
-    # Create terminal emulator
-    screen = pyte.Screen(200, 10000)
-    stream = pyte.Stream(screen)
-
-    # Skip the "Script started" header line
-    try:
-        first_newline = data.index(b'\n')
-        data = data[first_newline + 1:]
-    except ValueError:
-        pass
+def screen_to_html(screen):
+    """Convert pyte screen to HTML with colors."""
+    return '\n'.join(iter_screen_html(screen))
 
-    # Feed data to terminal emulator
-    try:
-        stream.feed(data.decode('utf-8', errors='replace'))
-    except Exception as e:
-        print(f"Warning: {e}", file=sys.stderr)
 
-    if html:
-        content = screen_to_html(screen)
-        output = f'''<!DOCTYPE html>
+HTML_HEADER = '''<!DOCTYPE html>
 <html>
 <head>
 <meta charset="UTF-8">
 <title>Claude Session Log</title>
 <style>
-body {{
+body {
     background-color: #1e1e1e;
     color: #d4d4d4;
     font-family: 'Fira Code', 'Consolas', 'Monaco', monospace;
     font-size: 14px;
     padding: 20px;
     margin: 0;
-}}
-pre {{
+}
+pre {
     white-space: pre-wrap;
     word-wrap: break-word;
     margin: 0;
     line-height: 1.4;
-}}
+}
 </style>
 </head>
 <body>
-<pre>{content}</pre>
+<pre>'''
+
+HTML_FOOTER = '''</pre>
 </body>
 </html>'''
+
+
+def play_log(input_file):
+    """Replay a script typescript file and return the final pyte screen."""
+    # Imported here so the usage path doesn't pay for loading pyte
+    import pyte
+
+    # Create terminal emulator
+    screen = pyte.Screen(200, 10000)
+    stream = pyte.Stream(screen)
+
+    # Decode and feed the raw log in chunks rather than reading it whole.
+    # newline='\n' splits lines on LF only and leaves CRs untranslated.
+    with open(input_file, encoding='utf-8', errors='replace', newline='\n',
+              buffering=1 << 20) as f:
+        # Skip the "Script started" header line
+        header = f.readline()
+
+        # No header line means the whole log is terminal output
+        chunk = header if not header.endswith('\n') else f.read(65536)
+
+        # Feed data to terminal emulator; only pyte errors are caught here,
+        # read errors propagate so a truncated screen is never returned
+        while chunk:
+            try:
+                stream.feed(chunk)
+            except Exception as e:
+                print(f"Warning: {e}", file=sys.stderr)
+                break
+            chunk = f.read(65536)
+
+    return screen
+
+
+def iter_html(input_file):
+    """Yield a standalone HTML document for a typescript file in chunks.
+
+    The header is yielded before playback starts, then one chunk per line.
+    """
+    yield HTML_HEADER
+    screen = play_log(input_file)
+    separator = ''
+    for line in iter_screen_html(screen):
+        yield separator + line
+        separator = '\n'
+    yield HTML_FOOTER
+
+
+def render_html(input_file):
+    """Render a script typescript file as a standalone HTML document."""
+    return ''.join(iter_html(input_file))
+
+
+def render_text(input_file):
+    """Render a script typescript file as clean plain text."""
+    screen = play_log(input_file)
+    lines = []
+    for line in screen.display:
+        stripped = line.rstrip()
+        if stripped:
+            lines.append(stripped)
+    while lines and not lines[-1].strip():
+        lines.pop()
+    return '\n'.join(lines)
+
+
+def clean_log(input_file, output_file=None, html=False):
+    """Process a script typescript file and output clean text or HTML."""
+    if html:
+        output = render_html(input_file)
     else:
-        # Plain text output
-        lines = []
-        for line in screen.display:
-            stripped = line.rstrip()
-            if stripped:
-                lines.append(stripped)
-        while lines and not lines[-1].strip():
-            lines.pop()
-        output = '\n'.join(lines)
+        output = render_text(input_file)
 
     if output_file:
         with open(output_file, 'w') as f:
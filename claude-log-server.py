@@ -6,26 +6,79 @@ Simple web server to browse and view Claude session logs over Tailscale.
 Serves from ~/claude-logs/ with on-demand HTML conversion.
 """
 
+import hashlib
+import importlib.util
 import os
 import re
-import subprocess
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from flask import Flask, Response, abort
+from flask import Flask, Response, abort, request, send_file, stream_with_context
 
 app = Flask(__name__)
 
 LOG_DIR = Path.home() / "claude-logs"
 CLEAN_SCRIPT = Path.home() / "claude-log-clean.py"
+CACHE_DIR = Path.home() / ".cache" / "claude-logs"
 
-# Cache for converted HTML (in-memory, cleared on restart)
-html_cache = {}
+# Log filename format: {session_name}_{YYYYMMDD_HHMMSS}.log
+LOG_FILENAME_RE = re.compile(r'(.+?)_(\d{8}_\d{6})\.log')
+
+# Cached get_sessions() result as (LOG_DIR mtime_ns, sessions)
+sessions_cache = None
+
+# Cache for converted HTML (in-memory LRU, cleared on restart)
+HTML_CACHE_SIZE = 64
+html_cache = OrderedDict()
+html_cache_lock = threading.Lock()
+
+
+def cache_get(key):
+    """Return cached HTML for key (marking it recently used), or None."""
+    with html_cache_lock:
+        html = html_cache.get(key)
+        if html is not None:
+            html_cache.move_to_end(key)
+        return html
+
+
+def cache_put(key, html):
+    """Store HTML under key, evicting the least recently used entries."""
+    with html_cache_lock:
+        # Drop older versions of the same log, as write_disk_cache does
+        for stale in [k for k in html_cache if k[0] == key[0] and k != key]:
+            del html_cache[stale]
+        html_cache[key] = html
+        html_cache.move_to_end(key)
+        while len(html_cache) > HTML_CACHE_SIZE:
+            html_cache.popitem(last=False)
+
+
+def load_cleaner():
+    """Return the clean script's module and its stat."""
+    script_st = CLEAN_SCRIPT.stat()
+    return import_cleaner(script_st.st_mtime_ns), script_st
+
+
+@lru_cache(maxsize=1)
+def import_cleaner(version):
+    """Import a version of the clean script in-process."""
+    # Fail as a 500 before streaming starts if pyte is missing
+    if importlib.util.find_spec('pyte') is None:
+        raise ImportError("No module named 'pyte' (pip3 install pyte)")
+    spec = importlib.util.spec_from_file_location('claude_log_clean', CLEAN_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
 
 
 def parse_log_filename(filename):
     """Extract session name and timestamp from log filename."""
-    # Format: {session_name}_{YYYYMMDD_HHMMSS}.log
-    match = re.match(r'^(.+)_(\d{8}_\d{6})\.log$', filename)
+    match = LOG_FILENAME_RE.fullmatch(filename)
     if match:
         name = match.group(1).replace('_', ' ').title()
         timestamp_str = match.group(2)
@@ -38,25 +91,62 @@ def parse_log_filename(filename):
 
 
 def get_sessions():
-    """Get list of sessions grouped by name with their logs."""
-    sessions = {}
+    """Get list of sessions grouped by name with their logs.
 
-    if not LOG_DIR.exists():
+    The listing is only rebuilt when LOG_DIR's mtime changes, i.e. when logs
+    are added, removed or renamed. Otherwise just the newest log of each
+    session is re-stat'ed, as that is the one still being written to.
+    """
+    global sessions_cache
+
+    try:
+        dir_mtime = LOG_DIR.stat().st_mtime_ns
+    except OSError:
+        return {}
+
+    if sessions_cache is not None and sessions_cache[0] == dir_mtime:
+        sessions = sessions_cache[1]
+        for logs in sessions.values():
+            refresh_size(logs[0])
         return sessions
 
-    for logfile in LOG_DIR.glob("*.log"):
-        name, timestamp = parse_log_filename(logfile.name)
-        size = logfile.stat().st_size
+    sessions = scan_sessions()
+    sessions_cache = (dir_mtime, sessions)
+    return sessions
+
+
+def refresh_size(log):
+    """Update a log entry's size from disk."""
+    try:
+        size = (LOG_DIR / log['filename']).stat().st_size
+    except OSError:
+        return
+    if size != log['size']:
+        log['size'] = size
+        log['size_human'] = format_size(size)
+
+
+def scan_sessions():
+    """Scan LOG_DIR for logs and group them by session name."""
+    sessions = {}
+
+    with os.scandir(LOG_DIR) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.log') or not entry.is_file():
+                continue
+
+            name, timestamp = parse_log_filename(entry.name)
+            size = entry.stat().st_size
 
-        if name not in sessions:
-            sessions[name] = []
+            if name not in sessions:
+                sessions[name] = []
 
-        sessions[name].append({
-            'filename': logfile.name,
-            'timestamp': timestamp,
-            'size': size,
-            'size_human': format_size(size),
-        })
+            sessions[name].append({
+                'filename': entry.name,
+                'timestamp': timestamp,
+                'size': size,
+                'size_human': format_size(size),
+            })
 
     # Sort logs within each session by timestamp (newest first)
     for name in sessions:
@@ -74,45 +164,99 @@ def format_size(size):
     return f"{size:.1f}TB"
 
 
+def log_etag(*stats):
+    """Build an ETag from the mtimes and sizes of the files behind a page."""
+    return '-'.join(f"{st.st_mtime_ns}-{st.st_size}" for st in stats)
+
+
+def disk_cache_path(log_path, st, version):
+    """Path of the on-disk HTML cache entry for a log stat and script version."""
+    digest = hashlib.sha1(str(log_path).encode()).hexdigest()
+    return CACHE_DIR / f"{digest}.{st.st_mtime_ns}-{st.st_size}-{version}.html"
+
+
+def write_disk_cache(cache_path, html):
+    """Atomically write a cache entry and drop stale ones for the same log."""
+    digest = cache_path.name.split('.', 1)[0]
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        for stale in CACHE_DIR.glob(f"{digest}.*.html"):
+            if stale != cache_path:
+                stale.unlink(missing_ok=True)
+
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, prefix=f"{digest}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(html)
+            os.replace(tmp, cache_path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+    except (OSError, ValueError):
+        # Caching is best-effort; the HTML is still served
+        pass
+
+
+def stream_conversion(cleaner, log_path, cache_key, cache_path):
+    """Yield HTML chunks as a log is converted, caching the finished page."""
+    chunks = []
+    try:
+        for chunk in cleaner.iter_html(str(log_path)):
+            chunks.append(chunk)
+            yield chunk
+    except Exception as e:
+        # The header has already gone out, so close the page after the error
+        yield f"\nError converting log: {e}</pre></body></html>"
+        return
+
+    html = ''.join(chunks)
+    write_disk_cache(cache_path, html)
+    cache_put(cache_key, html)
+
+
 def convert_log_to_html(logfile):
-    """Convert log to HTML, preferring fresh pre-converted files."""
+    """Convert log to HTML as (body, stats, finished), or None if missing."""
     log_path = LOG_DIR / logfile
     html_path = LOG_DIR / logfile.replace('.log', '.html')
 
-    if not log_path.exists():
+    try:
+        st = log_path.stat()
+    except OSError:
         return None
 
     # Check for pre-converted HTML file (for captured scrollback sessions)
     # Only use if HTML is newer than log (i.e., generated after log was finalized)
-    if html_path.exists():
-        html_mtime = html_path.stat().st_mtime
-        log_mtime = log_path.stat().st_mtime
-        if html_mtime >= log_mtime:
-            return html_path.read_text()
+    try:
+        html_st = html_path.stat()
+    except OSError:
+        html_st = None
+    if html_st is not None and html_st.st_mtime >= st.st_mtime:
+        return html_path.read_text(), (st, html_st), True
+
+    # Raises if the clean script can't be loaded; see view_log
+    cleaner, script_st = load_cleaner()
+    version = script_st.st_mtime_ns
 
     # Check cache
-    mtime = log_path.stat().st_mtime
-    cache_key = f"{logfile}:{mtime}"
+    cache_key = (logfile, st.st_mtime_ns, st.st_size, version)
 
-    if cache_key in html_cache:
-        return html_cache[cache_key]
+    html = cache_get(cache_key)
+    if html is not None:
+        return html, (st, script_st), True
 
-    # Convert using the clean script (for typescript logs)
+    # Check on-disk cache (survives restarts, invalidated by script updates)
+    cache_path = disk_cache_path(log_path, st, version)
     try:
-        result = subprocess.run(
-            ['python3', str(CLEAN_SCRIPT), str(log_path), '--html'],
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
-        if result.returncode == 0:
-            html = result.stdout
-            html_cache[cache_key] = html
-            return html
-    except Exception as e:
-        return f"<html><body><pre>Error converting log: {e}</pre></body></html>"
+        html = cache_path.read_text(encoding='utf-8')
+    except (OSError, ValueError):
+        html = None
+    if html is not None:
+        cache_put(cache_key, html)
+        return html, (st, script_st), True
 
-    return None
+    # Convert in-process using the clean script (for typescript logs)
+    chunks = stream_conversion(cleaner, log_path, cache_key, cache_path)
+    return chunks, (st, script_st), False
 
 
 @app.route('/')
@@ -120,14 +264,14 @@ def index():
     """Index page showing all sessions."""
     sessions = get_sessions()
 
-    # Sort sessions by most recent log
+    # Sort sessions by most recent log (each session's logs are newest first)
     sorted_sessions = sorted(
         sessions.items(),
-        key=lambda x: max((log['timestamp'] or datetime.min for log in x[1]), default=datetime.min),
+        key=lambda x: x[1][0]['timestamp'] or datetime.min,
         reverse=True
     )
 
-    html = """<!DOCTYPE html>
+    parts = ["""<!DOCTYPE html>
 <html>
 <head>
     <meta charset="UTF-8">
@@ -194,38 +338,38 @@ def index():
 </head>
 <body>
     <h1>Claude Session Logs</h1>
-"""
+"""]
 
     if not sorted_sessions:
-        html += '<p class="empty">No session logs found.</p>'
+        parts.append('<p class="empty">No session logs found.</p>')
     else:
         for name, logs in sorted_sessions:
             latest = logs[0]['timestamp']
             latest_str = latest.strftime('%Y-%m-%d %H:%M') if latest else 'Unknown'
 
-            html += f'''
+            parts.append(f'''
     <div class="session">
         <h2>{name}</h2>
         <div class="session-meta">{len(logs)} log(s) &bull; Latest: {latest_str}</div>
         <ul class="log-list">
-'''
+''')
             for log in logs[:10]:  # Show max 10 per session
                 ts = log['timestamp'].strftime('%Y-%m-%d %H:%M:%S') if log['timestamp'] else 'Unknown'
-                html += f'''            <li>
+                parts.append(f'''            <li>
                 <a href="/log/{log['filename']}">{ts}</a>
                 <span class="log-meta">{log['size_human']}</span>
             </li>
-'''
+''')
 
             if len(logs) > 10:
-                html += f'            <li class="log-meta">... and {len(logs) - 10} more</li>\n'
+                parts.append(f'            <li class="log-meta">... and {len(logs) - 10} more</li>\n')
 
-            html += '        </ul>\n    </div>\n'
+            parts.append('        </ul>\n    </div>\n')
 
-    html += """</body>
-</html>"""
+    parts.append("""</body>
+</html>""")
 
-    return html
+    return ''.join(parts)
 
 
 @app.route('/log/<filename>')
@@ -238,12 +382,34 @@ def view_log(filename):
     if not filename.endswith('.log'):
         abort(400)
 
-    html = convert_log_to_html(filename)
+    try:
+        result = convert_log_to_html(filename)
+    except Exception as e:
+        # Sent without validators, so a refresh retries the conversion
+        # instead of revalidating the error page
+        return Response(f"<html><body><pre>Error converting log: {e}</pre></body></html>",
+                        status=500, mimetype='text/html')
 
-    if html is None:
+    if result is None:
         abort(404)
 
-    return Response(html, mimetype='text/html')
+    body, stats, finished = result
+    if not finished:
+        # A streamed conversion may still fail part way, so it goes out
+        # without validators; the next view is served from the cache
+        response = Response(stream_with_context(body), mimetype='text/html')
+        response.cache_control.no_cache = True
+        return response
+
+    # Let browsers revalidate rather than re-download an unchanged log. The
+    # validators come from the same stats that picked the page, so they can
+    # never describe newer files than the body. The ETag is weak because
+    # the body may be gzipped on the way out.
+    response = Response(body, mimetype='text/html')
+    response.cache_control.no_cache = True
+    response.set_etag(log_etag(*stats), weak=True)
+    response.last_modified = max(st.st_mtime for st in stats)
+    return response.make_conditional(request)
 
 
 @app.route('/raw/<filename>')
@@ -254,10 +420,49 @@ def raw_log(filename):
 
     log_path = LOG_DIR / filename
 
-    if not log_path.exists():
+    try:
+        st = log_path.stat()
+    except OSError:
         abort(404)
 
-    return Response(log_path.read_text(errors='replace'), mimetype='text/plain')
+    # Stream straight from disk rather than reading the whole log into memory
+    return send_file(log_path, mimetype='text/plain', as_attachment=False,
+                     conditional=True, etag=log_etag(st))
+
+
+def gzip_chunks(chunks):
+    """Gzip byte chunks, flushing the first so streamed pages start early."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    flush_mode = zlib.Z_SYNC_FLUSH
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if flush_mode is not None:
+            data += compressor.flush(flush_mode)
+            flush_mode = None
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@app.after_request
+def compress_response(response):
+    """Gzip HTML responses (index and converted logs) when accepted."""
+    if (response.status_code not in (200, 304)
+            or response.direct_passthrough
+            or response.mimetype != 'text/html'
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    # Set whether or not this client gets gzip, so caches keep both copies;
+    # a 304 must carry the same Vary as the 200 it revalidates
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200 or not request.accept_encodings['gzip']:
+        return response
+
+    response.response = gzip_chunks(response.iter_encoded())
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers.pop('Content-Length', None)
+    return response
 
 
 if __name__ == '__main__':
@@ -267,10 +472,20 @@ if __name__ == '__main__':
     parser.add_argument('--host', default='0.0.0.0', help='Host to bind to')
     parser.add_argument('--port', type=int, default=8090, help='Port to listen on')
     parser.add_argument('--debug', action='store_true', help='Enable debug mode')
+    parser.add_argument('--threads', type=int, default=8, help='Worker threads (with waitress)')
 
     args = parser.parse_args()
 
     print(f"Starting Claude Log Server on http://{args.host}:{args.port}")
     print(f"Log directory: {LOG_DIR}")
 
-    app.run(host=args.host, port=args.port, debug=args.debug)
+    if args.debug:
+        app.run(host=args.host, port=args.port, debug=True)
+    else:
+        try:
+            from waitress import serve
+        except ImportError:
+            # Fall back to the Werkzeug server, one thread per request
+            app.run(host=args.host, port=args.port, threaded=True)
+        else:
+            serve(app, host=args.host, port=args.port, threads=args.threads)